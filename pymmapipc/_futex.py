@@ -0,0 +1,106 @@
+"""
+Futex wait/wake on 32-bit words inside a shared mapping (Linux only).
+
+Both calls use the shared (non-private) futex operations, so a waiter in one
+process is woken by a store + wake in another process mapping the same file.
+`SUPPORTED` is False on other platforms and callers must poll instead.
+"""
+
+
+import ctypes
+import errno
+import platform
+import sys
+import sysconfig
+
+from typing import Optional
+
+
+FUTEX_WAIT = 0
+FUTEX_WAKE = 1
+
+_INT_MAX = 0x7FFFFFFF
+
+# platform.machine() names the kernel, the pointer size tells a 32-bit userland
+# on a 64-bit kernel apart, which has to use the 32-bit syscall numbers
+_SYS_FUTEX = {
+    ('x86_64', 8): 202,
+    ('amd64', 8): 202,
+    ('x86_64', 4): 240,
+    ('amd64', 4): 240,
+    ('i386', 4): 240,
+    ('i686', 4): 240,
+    ('armv7l', 4): 240,
+    ('armv8l', 4): 240,
+    ('aarch64', 4): 240,
+    ('arm64', 4): 240,
+    ('aarch64', 8): 98,
+    ('arm64', 8): 98,
+    ('riscv64', 8): 98,
+    ('ppc64le', 8): 221,
+    ('s390x', 8): 238,
+}
+
+
+class _Timespec(ctypes.Structure):
+    _fields_ = [
+        ("tv_sec", ctypes.c_long),
+        ("tv_nsec", ctypes.c_long)
+    ]
+
+
+_ABI = (platform.machine(), ctypes.sizeof(ctypes.c_void_p))
+
+# x32 has 4-byte pointers on x86_64 but its own syscall numbering, leave it to polling
+SUPPORTED = (
+    sys.platform.startswith('linux')
+    and _ABI in _SYS_FUTEX
+    and not str(sysconfig.get_config_var('MULTIARCH') or '').endswith('gnux32')
+)
+
+if (SUPPORTED):
+    _libc = ctypes.CDLL(None, use_errno=True)
+    _syscall = _libc.syscall
+    _syscall.restype = ctypes.c_long
+    _sys_futex = ctypes.c_long(_SYS_FUTEX[_ABI])
+
+
+def buffer_address(buffer: object) -> int:
+    """Return the address of a writable buffer (e.g. an `mmap.mmap`).
+
+    The temporary ctypes export is dropped before returning, so the buffer can
+    still be closed later. The address is only valid while it stays open.
+    """
+    anchor = ctypes.c_char.from_buffer(buffer)     # type: ignore[arg-type]
+    address = ctypes.addressof(anchor)
+    del anchor
+
+    return address
+
+
+def wait(address: int, expected: int, timeout: Optional[float] = None) -> None:
+    """Sleep while the word at `address` equals `expected`.
+
+    Returns on wake-up, on timeout, on signal or immediately if the word already
+    differs; callers re-check their condition in every case.
+    """
+    timespec = None
+    if (timeout is not None):
+        seconds = int(timeout)
+        timespec = ctypes.byref(_Timespec(seconds, int((timeout - seconds) * 1e9)))
+
+    ret = _syscall(_sys_futex, ctypes.c_void_p(address), ctypes.c_int(FUTEX_WAIT),
+                   ctypes.c_uint32(expected), timespec, None, ctypes.c_int(0))
+    if (ret == -1):
+        err = ctypes.get_errno()
+        if (err not in (errno.EAGAIN, errno.EINTR, errno.ETIMEDOUT)):
+            raise OSError(err, f"futex wait failed: {errno.errorcode.get(err, err)}")
+
+
+def wake(address: int) -> None:
+    """Wake every waiter sleeping on the word at `address`."""
+    ret = _syscall(_sys_futex, ctypes.c_void_p(address), ctypes.c_int(FUTEX_WAKE),
+                   ctypes.c_int(_INT_MAX), None, None, ctypes.c_int(0))
+    if (ret == -1):
+        err = ctypes.get_errno()
+        raise OSError(err, f"futex wake failed: {errno.errorcode.get(err, err)}")
@@ -15,42 +15,99 @@
 | |     31    29                         0                             |
 | |                                                                    |
 | |     +--------------------------------+        +-----------------+  |
-| +---->|      Ring Buffer In Offset     |        | Single Buffer A |  |
-|       +--------------------------------+        +-----------------+  |
-|       |      Ring Buffer Out Offset    |        +----+------------+  |
-|       +--------------------------------+        |Size|  Data....  +--+
-|       |        Ring Buffer Size        |        +----+------------+
-|       +--------------------------------+       31    0
+| |     |        A In Waiter Flag        |        | Single Buffer A |  |
+| |     +--------------------------------+        +-----------------+  |
+| |     |        A Out Waiter Flag       |        +----+------------+  |
+| |     +--------------------------------+        |Size|  Data....  +--+
+| |     |        B In Waiter Flag        |        +----+------------+
+| |     +--------------------------------+       31    0
+| |     |        B Out Waiter Flag       |
+| |     +--------------------------------+
+| |     |       Reserved (28 bytes)      |
+| |     +--------------------------------+
+| |     31                               0
+| |
+| |     +--------------------------------+
+| +---->|      Ring Buffer In Offset     |
+|       +--------------------------------+
+|       |       Padding (60 bytes)       |
+|       +--------------------------------+
+|       |      Ring Buffer Out Offset    |
+|       +--------------------------------+
+|       |       Padding (60 bytes)       |
+|       +--------------------------------+
+|       |        Ring Buffer Size        |
+|       +--------------------------------+
+|       |       Padding (60 bytes)       |
+|       +--------------------------------+
 |       31                               0
 |
 |       +--------------------------------+
 +------>|      Ring Buffer In Offset     |
+        +--------------------------------+
+        |       Padding (60 bytes)       |
         +--------------------------------+
         |      Ring Buffer Out Offset    |
         +--------------------------------+
+        |       Padding (60 bytes)       |
+        +--------------------------------+
         |        Ring Buffer Size        |
         +--------------------------------+
+        |       Padding (60 bytes)       |
+        +--------------------------------+
         31                               0
+
+  Ring Buffer Size is a power of two. In / Out Offset are free-running 32-bit
+  counters, masked with Size - 1 to get the position in the buffer, so the
+  buffer is empty when In == Out and full when In - Out == Size.
+
+  The header is padded to 64 bytes and both buffers start on a 64-byte
+  boundary. The four words after Sign are futex waiter flags for A In, A Out,
+  B In and B Out; a side only issues a wake when the flag of the offset it
+  just moved is set. In Offset, Out Offset and Size are each padded to their
+  own cache line, so the producer and the consumer never write the same line.
+  The payload starts 192 bytes after the buffer base point.
 """
 
 
+import io
 import mmap
 import struct
 import os
+import sys
 import time
 
 from enum import IntEnum, Enum
-from typing import Optional, Tuple, Sequence
+from typing import List, Optional, Tuple, Sequence, Union
+
+from . import _futex
+
+if (sys.platform == 'win32'):
+    import msvcrt
+
+else:
+    import fcntl
+
+
+CACHE_LINE_SIZE = 64
 
 
 class StructFormats(Enum):
-    Header = "<IIIII"
-    Buffer = "<III"
+    Header = "<IIIII44x"
+    Buffer = "<I60xI60xI60x"
+
+
+# Compiled once, shared by every header/buffer access
+_HDR = struct.Struct(StructFormats.Header.value)
+_BUF = struct.Struct(StructFormats.Buffer.value)
+_U32 = struct.Struct('<I')
+_OFFSETS = struct.Struct('<I60xI')  # In/Out offset prefix of a buffer header
+_OFFSET_MASK = 0xFFFFFFFF
 
 
 class StructSizes(IntEnum):
-    Header = struct.calcsize(StructFormats.Header.value)
-    Buffer = struct.calcsize(StructFormats.Buffer.value)
+    Header = _HDR.size
+    Buffer = _BUF.size
 
 
 class HeaderIndices(IntEnum):
@@ -73,239 +130,485 @@ class SignBits(IntEnum):
     RST = 0x80000000
 
 
-__version__ = 1
+__version__ = 5
 MAGIC_NUMBER = 0x50414D4D
 
+# Waiter flags live in the reserved words right after Sign
+_WAITERS_PTR = (HeaderIndices.Sign + 1) * 4
+
+# Upper bound of a single futex sleep, a wake lost to store reordering between
+# the offset store and the flag load only costs this much
+_FUTEX_WAIT_SLICE = 0.1
+
+# Windows byte-range lock target, past any mapping so it never overlaps data
+_WIN_LOCK_OFFSET = 0x7FFFFFFF
+
+
+def _align(value: int, alignment: int) -> int:
+    return (value + alignment - 1) & ~(alignment - 1)
+
+
+def _calc_layout(buff_size: int) -> Tuple[int, int, int]:
+    # Both buffers start on a cache line, which also keeps offset words aligned for futex
+    buff_base_ptr_A = StructSizes.Header
+    buff_base_ptr_B = _align(buff_base_ptr_A + StructSizes.Buffer + buff_size, CACHE_LINE_SIZE)
+    file_size = buff_base_ptr_B + StructSizes.Buffer + buff_size
+
+    return (buff_base_ptr_A, buff_base_ptr_B, file_size)
+
+
+def _payload_pages(payload_ptr: int, buff_size: int, page_size: int) -> Tuple[int, int]:
+    # madvise works on whole pages, pages shared with a header or the other ring are left out
+    start = _align(payload_ptr, page_size)
+    end = (payload_ptr + buff_size) & ~(page_size - 1)
+
+    return (start, max(end - start, 0))
+
+
+def _ring_write(mv: memoryview, payload_base: int, buff_size: int, pos: int, src: memoryview) -> None:
+    len_f = min(len(src), buff_size - pos)
+    mv[payload_base + pos:payload_base + pos + len_f] = src[:len_f]
+    if (len_f < len(src)):
+        mv[payload_base:payload_base + len(src) - len_f] = src[len_f:]
+
+
+def _ring_read(mv: memoryview, payload_base: int, buff_size: int, pos: int, dst: memoryview) -> None:
+    len_f = min(len(dst), buff_size - pos)
+    dst[:len_f] = mv[payload_base + pos:payload_base + pos + len_f]
+    if (len_f < len(dst)):
+        dst[len_f:] = mv[payload_base:payload_base + len(dst) - len_f]
+
+
+def _ring_put(mv: memoryview, payload_base: int, buff_size: int, pos: int, src: memoryview) -> None:
+    # Size prefixed message at ring position pos, caller has checked the space
+    if (buff_size - pos >= 4):
+        _U32.pack_into(mv, payload_base + pos, len(src))
+
+    else:
+        _ring_write(mv, payload_base, buff_size, pos, memoryview(_U32.pack(len(src))))
+
+    _ring_write(mv, payload_base, buff_size, (pos + 4) & (buff_size - 1), src)
+
+
+def _ring_get_size(mv: memoryview, payload_base: int, buff_size: int, pos: int) -> int:
+    if (buff_size - pos >= 4):
+        return _U32.unpack_from(mv, payload_base + pos)[0]
+
+    raw_data_size = bytearray(4)
+    _ring_read(mv, payload_base, buff_size, pos, memoryview(raw_data_size))
+    return _U32.unpack(raw_data_size)[0]
+
 
 class MmapIPC():
     def __init__(self, mmap_file: str, buff_size: int = 4096):
         self.is_initialized = False
+        self._closed = False
 
-        # Initialize file
-        if (not os.path.exists(mmap_file)):
-            self.__init_mmap_file(mmap_file, buff_size)
+        if (buff_size <= 0 or buff_size > 0x80000000):
+            raise ValueError(f"Invalid buffer size: {buff_size}")
 
-        self.mmap = self.__mmap(mmap_file)
+        # Round up to a power of two, ring positions are then offset & (size - 1)
+        buff_size = 1 << (buff_size - 1).bit_length()
 
-        header = self.__read_mmap_header()
-        if (header[HeaderIndices.Magic] == 0x00000000):
-            self.__init_mmap_struct(buff_size)
+        self.fd = self.__open_mmap_file(mmap_file)
 
-        elif (header[HeaderIndices.Magic] not in [MAGIC_NUMBER, 0x00000000]):
+        # Initialization runs under the Sign lock, flock is dropped when its holder
+        # dies, so whoever comes next finishes a half-initialized file
+        self.__lock()
+        try:
+            self.mmap, initialized = self.__mmap(buff_size)
+            if (not initialized):
+                self.__init_mmap_struct(buff_size)
+
+        finally:
+            self.__unlock()
+
+        header = self.__read_mmap_header()
+        if (header[HeaderIndices.Magic] != MAGIC_NUMBER):
             raise BufferError(
                 f"Error magic number: {str(bytes.fromhex(hex(header[HeaderIndices.Magic])[2:])[::-1])}"
             )
 
+        elif (header[HeaderIndices.Version] != __version__):
+            raise BufferError(f"Unsupported version: {header[HeaderIndices.Version]}")
+
         self.assign_op = 0
         self.recv_buff_base_ptr = 0
         self.send_buff_base_ptr = 0
 
         self.assign_op, self.recv_buff_base_ptr, self.send_buff_base_ptr = self.__get_buff_base_ptr()
 
+        # Plain int pointers, keeps IntEnum lookups out of send/recv
+        self._send_payload_ptr = self.send_buff_base_ptr + int(StructSizes.Buffer)
+        self._send_in_offset_ptr = self.send_buff_base_ptr + int(BufferIndices.InOffset) * CACHE_LINE_SIZE
+        self._recv_payload_ptr = self.recv_buff_base_ptr + int(StructSizes.Buffer)
+        self._recv_out_offset_ptr = self.recv_buff_base_ptr + int(BufferIndices.OutOffset) * CACHE_LINE_SIZE
+        self._send_out_offset_ptr = self.send_buff_base_ptr + int(BufferIndices.OutOffset) * CACHE_LINE_SIZE
+        self._recv_in_offset_ptr = self.recv_buff_base_ptr + int(BufferIndices.InOffset) * CACHE_LINE_SIZE
+
+        # Buffer size never changes once initialized
+        self._send_buff_size = self.__read_buff_header(self.send_buff_base_ptr)[BufferIndices.Size]
+        self._recv_buff_size = self.__read_buff_header(self.recv_buff_base_ptr)[BufferIndices.Size]
+        self._send_mask = self._send_buff_size - 1
+        self._recv_mask = self._recv_buff_size - 1
+
+        # Blocking send/recv sleep on the peer's offset word, 0 means polling
+        self._mmap_addr = _futex.buffer_address(self.mmap) if _futex.SUPPORTED else 0
+
+        # OPA receives on A and sends on B, OPB the other way round
+        recv_ring, send_ring = (0, 1) if self.assign_op == SignBits.OPA else (1, 0)
+        self._send_in_waiter_ptr = _WAITERS_PTR + (send_ring * 2 + BufferIndices.InOffset) * 4
+        self._send_out_waiter_ptr = _WAITERS_PTR + (send_ring * 2 + BufferIndices.OutOffset) * 4
+        self._recv_in_waiter_ptr = _WAITERS_PTR + (recv_ring * 2 + BufferIndices.InOffset) * 4
+        self._recv_out_waiter_ptr = _WAITERS_PTR + (recv_ring * 2 + BufferIndices.OutOffset) * 4
+
+        self.__advise_buff(self.send_buff_base_ptr, self._send_buff_size)
+        self.__advise_buff(self.recv_buff_base_ptr, self._recv_buff_size)
+
         self.is_initialized = True
 
-    def __mmap(self, mmap_file: str) -> mmap.mmap:
-        self.fd = open(mmap_file, 'r+b')
-        return mmap.mmap(
+    def __open_mmap_file(self, mmap_file: str) -> io.FileIO:
+        flags = os.O_RDWR | os.O_CREAT | getattr(os, 'O_BINARY', 0)
+        return os.fdopen(os.open(mmap_file, flags, 0o666), 'r+b', buffering=0)
+
+    def __mmap(self, buff_size: int) -> Tuple[mmap.mmap, bool]:
+        # Caller holds the lock; the magic number is written last, so 0 means a
+        # new file or a creator that died part way through
+        self.fd.seek(0)
+        raw_magic = self.fd.read(4)
+        initialized = len(raw_magic) == 4 and _U32.unpack(raw_magic)[0] != 0x00000000
+
+        if (not initialized):
+            self.__init_mmap_file(self.fd.fileno(), buff_size)
+
+        return (mmap.mmap(
             self.fd.fileno(),
             0,
             access=mmap.ACCESS_WRITE
-        )
+        ), initialized)
 
-    def __init_mmap_file(self, mmap_file: str, buff_size: int) -> None:
-        struct_size = StructSizes.Header + StructSizes.Buffer * 2
+    def __lock(self) -> None:
+        # Serializes the Sign read-modify-write between openers, flock is per open file
+        if (sys.platform == 'win32'):
+            os.lseek(self.fd.fileno(), _WIN_LOCK_OFFSET, os.SEEK_SET)
+            msvcrt.locking(self.fd.fileno(), msvcrt.LK_LOCK, 1)
 
-        with open(mmap_file, 'wb') as f:
-            f.write(b'\x00' * (struct_size + (buff_size + 1) * 2))
+        else:
+            fcntl.flock(self.fd.fileno(), fcntl.LOCK_EX)
 
-    def __init_mmap_struct(self, buff_size: int) -> None:
-        buff_base_ptr_A = StructSizes.Header
-        buff_base_ptr_B = buff_base_ptr_A + StructSizes.Buffer + buff_size + 1
+    def __unlock(self) -> None:
+        if (sys.platform == 'win32'):
+            os.lseek(self.fd.fileno(), _WIN_LOCK_OFFSET, os.SEEK_SET)
+            msvcrt.locking(self.fd.fileno(), msvcrt.LK_UNLCK, 1)
 
-        # Initialize mmap header
-        self.__write_mmap_header((
-            MAGIC_NUMBER,
-            __version__,
-            buff_base_ptr_A,
-            buff_base_ptr_B,
-            0x00000000
-        ))
+        else:
+            fcntl.flock(self.fd.fileno(), fcntl.LOCK_UN)
+
+    def __advise_buff(self, buff_base_ptr: int, buff_size: int) -> None:
+        if (sys.platform == 'win32' or not hasattr(self.mmap, 'madvise')):
+            return
+
+        # Payloads are streamed; rings too small to own a whole page get no hint at all
+        payload_page, length = _payload_pages(buff_base_ptr + StructSizes.Buffer, buff_size, mmap.PAGESIZE)
+        if (length):
+            self.mmap.madvise(mmap.MADV_SEQUENTIAL, payload_page, length)
+
+    def __init_mmap_file(self, fd: int, buff_size: int) -> None:
+        file_size = _calc_layout(buff_size)[2]
+
+        # Sparse file, pages read as zero until first touched; never shrink a file
+        # that was already sized
+        if (os.fstat(fd).st_size < file_size):
+            os.ftruncate(fd, file_size)
+
+    def __init_mmap_struct(self, buff_size: int) -> None:
+        buff_base_ptr_A, buff_base_ptr_B, _ = _calc_layout(buff_size)
 
         # Initialize buff A
         self.__write_buff_header(
             buff_base_ptr_A,
-            (0x00000000, 0x00000000, buff_size + 1)
+            (0x00000000, 0x00000000, buff_size)
         )
 
         # Initialize buff B
         self.__write_buff_header(
             buff_base_ptr_B,
-            (0x00000000, 0x00000000, buff_size + 1)
+            (0x00000000, 0x00000000, buff_size)
         )
 
+        # Initialize mmap header, magic number last so a partial init is redone by the next opener
+        self.__write_mmap_header((
+            0x00000000,
+            __version__,
+            buff_base_ptr_A,
+            buff_base_ptr_B,
+            0x00000000
+        ))
+        _U32.pack_into(self.mmap, HeaderIndices.Magic * 4, MAGIC_NUMBER)
+
     def __get_buff_base_ptr(self) -> Tuple:
-        header = list(self.__read_mmap_header())
-        sign = header[HeaderIndices.Sign]
-        self.mmap.seek(0)
-        if (not (sign & SignBits.OPA)):
-            # OPA
-            header[HeaderIndices.Sign] = sign | SignBits.OPA
-            self.mmap.write(struct.pack(
-                StructFormats.Header.value,
-                *header
-            ))
-
-            return (SignBits.OPA, header[HeaderIndices.Buffer_Base_Point_A], header[HeaderIndices.Buffer_Base_Point_B])
-
-        if (not (sign & SignBits.OPB)):
-            # OPB
-            header[HeaderIndices.Sign] = sign | SignBits.OPB
-            self.mmap.write(struct.pack(
-                StructFormats.Header.value,
-                *header
-            ))
-
-            return (SignBits.OPB, header[HeaderIndices.Buffer_Base_Point_B], header[HeaderIndices.Buffer_Base_Point_A])
+        self.__lock()
+        try:
+            header = self.__read_mmap_header()
+            sign = header[HeaderIndices.Sign]
+            if (not (sign & SignBits.OPA)):
+                # OPA
+                self.__update_sign(sign | SignBits.OPA)
+
+                return (SignBits.OPA, header[HeaderIndices.Buffer_Base_Point_A], header[HeaderIndices.Buffer_Base_Point_B])
+
+            if (not (sign & SignBits.OPB)):
+                # OPB
+                self.__update_sign(sign | SignBits.OPB)
+
+                return (SignBits.OPB, header[HeaderIndices.Buffer_Base_Point_B], header[HeaderIndices.Buffer_Base_Point_A])
+
+        finally:
+            self.__unlock()
 
         raise BufferError("This mmap file in use.")
 
+    def __update_sign(self, sign: int) -> None:
+        _U32.pack_into(self.mmap, HeaderIndices.Sign * 4, sign)
+
     def __read_buff_header(self, buff_ptr: int) -> Tuple:
-        self.mmap.seek(buff_ptr)
-        raw_buff_header = self.mmap.read(StructSizes.Buffer)
-        return struct.unpack(StructFormats.Buffer.value, raw_buff_header)
+        return _BUF.unpack_from(self.mmap, buff_ptr)
+
+    def __read_buff_offsets(self, buff_ptr: int) -> Tuple:
+        return _OFFSETS.unpack_from(self.mmap, buff_ptr)
 
     def __write_buff_header(self, buff_base_ptr: int, header: Sequence) -> None:
-        self.mmap.seek(buff_base_ptr)
-        self.mmap.write(struct.pack(
-            StructFormats.Buffer.value,
-            *header
-        ))
+        _BUF.pack_into(self.mmap, buff_base_ptr, *header)
 
     def __update_buff_offset(self, offset_ptr: int, offset: int) -> None:
-        self.mmap.seek(offset_ptr)
-        self.mmap.write(struct.pack(
-            '<I',
-            offset
-        ))
+        _U32.pack_into(self.mmap, offset_ptr, offset)
 
     def __read_mmap_header(self) -> Tuple:
-        self.mmap.seek(0)
-        raw_mmap_header = self.mmap.read(StructSizes.Header)
-        return struct.unpack(StructFormats.Header.value, raw_mmap_header)
+        return _HDR.unpack_from(self.mmap, 0)
 
     def __write_mmap_header(self, header: Sequence) -> None:
-        self.mmap.seek(0)
-        self.mmap.write(struct.pack(
-            StructFormats.Header.value,
-            *header
-        ))
-
-    def __calc_buff_available_size(self, in_offset: int, out_offset: int, buff_size: int) -> Tuple[int, int]:
-        if in_offset >= out_offset:
-            return (buff_size - in_offset, out_offset)
+        _HDR.pack_into(self.mmap, 0, *header)
+
+    def __wait_offset(self, offset_ptr: int, waiter_ptr: int, offset: int, deadline: Optional[float],
+                      attempt: int) -> None:
+        timeout = None
+        if (deadline is not None):
+            timeout = deadline - time.monotonic()
+            if (timeout <= 0):
+                raise TimeoutError()
+
+        if (self._mmap_addr):
+            # Flag first, the futex call re-checks the offset so a move in between is not missed
+            _U32.pack_into(self.mmap, waiter_ptr, 1)
+            _futex.wait(
+                self._mmap_addr + offset_ptr,
+                offset,
+                _FUTEX_WAIT_SLICE if timeout is None else min(_FUTEX_WAIT_SLICE, timeout)
+            )
 
         else:
-            return (out_offset - in_offset, 0)
+            # Yield first, then back off so an idle wait stays cheap
+            if (attempt < 64):
+                sleep_time = 0.0
 
-    def send(self, data: bytes, blocking: bool = False, timeout: Optional[float] = 15.0) -> int:
-        in_offset, out_offset, buff_size = self.__read_buff_header(self.send_buff_base_ptr)
+            elif (attempt < 128):
+                sleep_time = 0.0001
+
+            else:
+                sleep_time = 0.01
+
+            time.sleep(sleep_time if timeout is None else min(sleep_time, timeout))
 
-        front_available, back_available = self.__calc_buff_available_size(in_offset, out_offset, buff_size)
-        total_available = front_available + back_available
+    def __clear_waiter(self, waiter_ptr: int) -> None:
+        if (self._mmap_addr):
+            _U32.pack_into(self.mmap, waiter_ptr, 0)
 
+    def __notify_offset(self, offset_ptr: int, waiter_ptr: int) -> None:
+        # Skip the syscall unless the peer is actually sleeping on this offset
+        if (self._mmap_addr and _U32.unpack_from(self.mmap, waiter_ptr)[0]):
+            _futex.wake(self._mmap_addr + offset_ptr)
+
+    def __calc_buff_available_size(self, in_offset: int, out_offset: int, buff_size: int) -> int:
+        return buff_size - ((in_offset - out_offset) & _OFFSET_MASK)
+
+    def send(self, data: bytes, blocking: bool = False, timeout: Optional[float] = 15.0) -> int:
         data_size = len(data)
-        require_size = data_size + 4
 
-        if (total_available < require_size and not blocking):
+        in_offset = self.__wait_send(data_size + 4, blocking, timeout)
+        if (in_offset is None):
             return 0
 
-        sleep_time = 0.1
-        while total_available < require_size:
-            if (timeout is not None):
-                if (timeout <= 0):
-                    raise TimeoutError()
+        in_pos = in_offset & self._send_mask
+        with memoryview(self.mmap) as mv:
+            if (in_pos + data_size + 4 <= self._send_buff_size):
+                # No wrap: one size store and one copy
+                ptr = self._send_payload_ptr + in_pos
+                _U32.pack_into(mv, ptr, data_size)
+                mv[ptr + 4:ptr + 4 + data_size] = data
 
-                sleep_time = min(sleep_time, timeout)
-                timeout -= sleep_time
+            else:
+                with memoryview(data) as src:
+                    _ring_put(mv, self._send_payload_ptr, self._send_buff_size, in_pos, src)
 
-            time.sleep(sleep_time)
-            in_offset, out_offset, buff_size = self.__read_buff_header(self.send_buff_base_ptr)
-            front_available, back_available = self.__calc_buff_available_size(in_offset, out_offset, buff_size)
-            total_available = front_available + back_available
+        self.__commit_send((in_offset + data_size + 4) & _OFFSET_MASK)
 
-        len_f = min(require_size, front_available)
-        self.mmap.seek(self.send_buff_base_ptr + StructSizes.Buffer + in_offset)
-        data = struct.pack('<I', data_size) + data
-        self.mmap.write(data[:len_f])
+        return data_size
+
+    def send_many(self, messages: Sequence[bytes], blocking: bool = False, timeout: Optional[float] = 15.0) -> int:
+        # All or nothing, in_offset is published once for the whole batch
+        require_size = sum(len(data) for data in messages) + 4 * len(messages)
+        if (require_size > self._send_buff_size):
+            raise ValueError(f"Batch too large: {require_size} bytes required, buffer holds {self._send_buff_size}")
 
-        len_b = data_size - len_f
-        if (len_b > 0):
-            self.mmap.seek(self.send_buff_base_ptr + StructSizes.Buffer)
-            self.mmap.write(data[len_f:])
+        in_offset = self.__wait_send(require_size, blocking, timeout)
+        if (in_offset is None):
+            return 0
 
-        # Update in_offset
-        in_offset = (in_offset + require_size) % buff_size
-        self.__update_buff_offset(self.send_buff_base_ptr + (BufferIndices.InOffset * 4), in_offset)
+        with memoryview(self.mmap) as mv:
+            for data in messages:
+                with memoryview(data) as src:
+                    _ring_put(mv, self._send_payload_ptr, self._send_buff_size, in_offset & self._send_mask, src)
 
-        return data_size
+                in_offset = (in_offset + len(data) + 4) & _OFFSET_MASK
+
+        self.__commit_send(in_offset)
+
+        return len(messages)
 
     def recv(self, blocking: bool = False, timeout: Optional[float] = 15.0) -> Optional[bytes]:
-        in_offset, out_offset, buff_size = self.__read_buff_header(self.recv_buff_base_ptr)
+        offsets = self.__wait_recv(blocking, timeout)
+        if (offsets is None):
+            return None
 
-        if (in_offset == out_offset and not blocking):
+        out_offset = offsets[1]
+        with memoryview(self.mmap) as mv:
+            out_pos = out_offset & self._recv_mask
+            data_size = _ring_get_size(mv, self._recv_payload_ptr, self._recv_buff_size, out_pos)
+
+            if (out_pos + data_size + 4 <= self._recv_buff_size):
+                # No wrap: copy straight out of the mapping
+                ptr = self._recv_payload_ptr + out_pos + 4
+                data = bytes(mv[ptr:ptr + data_size])
+
+            else:
+                buffer = bytearray(data_size)
+                _ring_read(mv, self._recv_payload_ptr, self._recv_buff_size, (out_pos + 4) & self._recv_mask,
+                           memoryview(buffer))
+                data = bytes(buffer)
+
+        self.__commit_recv((out_offset + data_size + 4) & _OFFSET_MASK)
+
+        return data
+
+    def recv_into(self, buffer: Union[bytearray, memoryview], blocking: bool = False,
+                  timeout: Optional[float] = 15.0) -> Optional[int]:
+        offsets = self.__wait_recv(blocking, timeout)
+        if (offsets is None):
             return None
 
-        sleep_time = 0.1
-        while in_offset == out_offset:
-            if (timeout is not None):
-                if (timeout <= 0):
-                    raise TimeoutError()
+        out_offset = offsets[1]
+        with memoryview(self.mmap) as mv, memoryview(buffer).cast('B') as dst:
+            out_pos = out_offset & self._recv_mask
+            data_size = _ring_get_size(mv, self._recv_payload_ptr, self._recv_buff_size, out_pos)
+            if (data_size > len(dst)):
+                raise ValueError(f"Buffer too small: {data_size} bytes required")
 
-                sleep_time = min(sleep_time, timeout)
-                timeout -= sleep_time
+            _ring_read(mv, self._recv_payload_ptr, self._recv_buff_size, (out_pos + 4) & self._recv_mask, dst[:data_size])
 
-            time.sleep(sleep_time)
-            in_offset, out_offset, buff_size = self.__read_buff_header(self.recv_buff_base_ptr)
+        self.__commit_recv((out_offset + data_size + 4) & _OFFSET_MASK)
 
-        self.mmap.seek(self.recv_buff_base_ptr + StructSizes.Buffer + out_offset)
+        return data_size
 
-        tail_read_len = buff_size - out_offset
-        if (tail_read_len < 4):
-            raw_data_size = self.mmap.read(tail_read_len)
-            self.mmap.seek(self.recv_buff_base_ptr + StructSizes.Buffer)
-            raw_data_size += self.mmap.read(4 - tail_read_len)
+    def recv_many(self, max_count: Optional[int] = None, blocking: bool = False,
+                  timeout: Optional[float] = 15.0) -> List[bytes]:
+        # Everything pending (up to max_count), out_offset is published once for the whole batch
+        offsets = self.__wait_recv(blocking, timeout)
+        if (offsets is None):
+            return []
 
-        else:
-            raw_data_size = self.mmap.read(4)
+        in_offset, out_offset = offsets
+        messages: List[bytes] = []
+        with memoryview(self.mmap) as mv:
+            while (out_offset != in_offset and (max_count is None or len(messages) < max_count)):
+                out_pos = out_offset & self._recv_mask
+                data_size = _ring_get_size(mv, self._recv_payload_ptr, self._recv_buff_size, out_pos)
 
-        data_size: int
-        data_size = struct.unpack('<I', raw_data_size)[0]
+                data = bytearray(data_size)
+                _ring_read(mv, self._recv_payload_ptr, self._recv_buff_size, (out_pos + 4) & self._recv_mask, memoryview(data))
+                messages.append(bytes(data))
 
-        len_f = min(data_size, buff_size - (out_offset + 4))
+                out_offset = (out_offset + data_size + 4) & _OFFSET_MASK
 
-        if (len_f <= 0):
-            len_f = data_size
+        self.__commit_recv(out_offset)
 
-        data = self.mmap.read(len_f)
+        return messages
 
-        len_b = data_size - len(data)
-        if (len_b > 0):
-            self.mmap.seek(self.recv_buff_base_ptr + StructSizes.Buffer)
-            data_b = self.mmap.read(len_b)
-            data += data_b
+    def __wait_send(self, require_size: int, blocking: bool, timeout: Optional[float]) -> Optional[int]:
+        buff_size = self._send_buff_size
+        in_offset, out_offset = self.__read_buff_offsets(self.send_buff_base_ptr)
 
-        # Update out_offset
-        out_offset = (out_offset + 4 + data_size) % buff_size
-        self.__update_buff_offset(self.recv_buff_base_ptr + (BufferIndices.OutOffset * 4), out_offset)
+        total_available = self.__calc_buff_available_size(in_offset, out_offset, buff_size)
 
-        return data
+        if (total_available < require_size and not blocking):
+            return None
+
+        deadline = None if timeout is None else time.monotonic() + timeout
+        attempt = 0
+        try:
+            while total_available < require_size:
+                self.__wait_offset(self._send_out_offset_ptr, self._send_out_waiter_ptr, out_offset, deadline, attempt)
+                attempt += 1
+                in_offset, out_offset = self.__read_buff_offsets(self.send_buff_base_ptr)
+                total_available = self.__calc_buff_available_size(in_offset, out_offset, buff_size)
+
+        finally:
+            if (attempt):
+                self.__clear_waiter(self._send_out_waiter_ptr)
+
+        return in_offset
+
+    def __commit_send(self, in_offset: int) -> None:
+        self.__update_buff_offset(self._send_in_offset_ptr, in_offset)
+        self.__notify_offset(self._send_in_offset_ptr, self._send_in_waiter_ptr)
+
+    def __wait_recv(self, blocking: bool, timeout: Optional[float]) -> Optional[Tuple[int, int]]:
+        in_offset, out_offset = self.__read_buff_offsets(self.recv_buff_base_ptr)
+
+        if (in_offset == out_offset and not blocking):
+            return None
+
+        deadline = None if timeout is None else time.monotonic() + timeout
+        attempt = 0
+        try:
+            while in_offset == out_offset:
+                self.__wait_offset(self._recv_in_offset_ptr, self._recv_in_waiter_ptr, in_offset, deadline, attempt)
+                attempt += 1
+                in_offset, out_offset = self.__read_buff_offsets(self.recv_buff_base_ptr)
+
+        finally:
+            if (attempt):
+                self.__clear_waiter(self._recv_in_waiter_ptr)
+
+        return (in_offset, out_offset)
+
+    def __commit_recv(self, out_offset: int) -> None:
+        self.__update_buff_offset(self._recv_out_offset_ptr, out_offset)
+        self.__notify_offset(self._recv_out_offset_ptr, self._recv_out_waiter_ptr)
+
+    def close(self) -> None:
+        if (self._closed):
+            return
+
+        self._closed = True
 
-    def __del__(self) -> None:
         if (self.is_initialized):
             # Clean OP Bit
-            raw_mmap_header = list(self.__read_mmap_header())
-            raw_mmap_header[HeaderIndices.Sign] &= ~self.assign_op
-            self.__write_mmap_header(raw_mmap_header)
+            self.__lock()
+            try:
+                self.__update_sign(self.__read_mmap_header()[HeaderIndices.Sign] & ~self.assign_op)
+
+            finally:
+                self.__unlock()
 
             # Clean recv buffer
             raw_recv_buff_header = list(self.__read_buff_header(self.recv_buff_base_ptr))
@@ -313,6 +616,22 @@ class MmapIPC():
             raw_recv_buff_header[BufferIndices.OutOffset] = 0
             self.__write_buff_header(self.recv_buff_base_ptr, raw_recv_buff_header)
 
-        # Close & Release
-        self.mmap.close()
-        self.fd.close()
+            # A sender blocked on the old offsets has to re-read them
+            self.__notify_offset(self._recv_in_offset_ptr, self._recv_in_waiter_ptr)
+            self.__notify_offset(self._recv_out_offset_ptr, self._recv_out_waiter_ptr)
+
+        # Close & Release, __init__ may have failed before mapping
+        if (hasattr(self, 'mmap')):
+            self.mmap.close()
+
+        if (hasattr(self, 'fd')):
+            self.fd.close()
+
+    def __enter__(self) -> 'MmapIPC':
+        return self
+
+    def __exit__(self, *args: object) -> None:
+        self.close()
+
+    def __del__(self) -> None:
+        self.close()
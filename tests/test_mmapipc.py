@@ -1,11 +1,19 @@
 import pytest
 import os
 import struct
+import threading
+import time
 
-from multiprocessing import Queue, Process
+from multiprocessing import Barrier, Queue, Process, synchronize
 from typing import List
 
-from pymmapipc.mmapipc import MmapIPC, MAGIC_NUMBER, StructFormats, StructSizes, HeaderIndices, SignBits
+from pymmapipc import _futex
+from pymmapipc.mmapipc import _calc_layout, _payload_pages
+from pymmapipc.mmapipc import MmapIPC, MAGIC_NUMBER, StructFormats, StructSizes, HeaderIndices, SignBits, __version__
+
+
+# A futex wake is immediate, polling may be in its 10 ms backoff on a loaded runner
+WAKE_LATENCY = 0.05 if _futex.SUPPORTED else 1.0
 
 
 @pytest.fixture
@@ -25,7 +33,7 @@ def test_initialize(temp_file):
         raw_header = f.read(StructSizes.Header)
         magic, version, ptr_a, ptr_b, sign = struct.unpack(StructFormats.Header.value, raw_header)
         assert magic == MAGIC_NUMBER
-        assert version == 1
+        assert version == __version__
         assert sign & (SignBits.OPA | SignBits.OPB) != 0
         assert sign & SignBits.OPA == SignBits.OPA
 
@@ -64,6 +72,19 @@ def test_reset_behavior(temp_file):
         assert sign & (SignBits.OPA | SignBits.OPB) == 0
 
 
+@pytest.mark.parametrize("file_size", [0, 100, 10000])
+def test_recover_partial_init(temp_file, file_size):
+    # A creator that died before writing the magic number leaves an empty or zeroed file
+    with open(temp_file, 'wb') as f:
+        f.write(b'\x00' * file_size)
+
+    start = time.monotonic()
+    with MmapIPC(temp_file) as oa, MmapIPC(temp_file) as ob:
+        assert time.monotonic() - start < 1.0
+        oa.send(b'Hello')
+        assert ob.recv() == b'Hello'
+
+
 def test_invalid_magic(temp_file):
     MmapIPC(temp_file)
 
@@ -77,34 +98,129 @@ def test_invalid_magic(temp_file):
     assert str(e.value) == f"Error magic number: {bytes.fromhex(hex(0xDEADBEEF)[2:])[::-1]}"
 
 
+def test_invalid_version(temp_file):
+    MmapIPC(temp_file)
+
+    with open(temp_file, 'r+b') as f:
+        f.seek(HeaderIndices.Version * 4)
+        f.write(struct.pack('<I', 1))
+
+    with pytest.raises(BufferError) as e:
+        MmapIPC(temp_file)
+
+    assert str(e.value) == "Unsupported version: 1"
+
+
+def test_close(temp_file):
+    with MmapIPC(temp_file) as oa:
+        with open(temp_file, 'rb') as f:
+            raw_header = f.read(StructSizes.Header)
+            sign = struct.unpack(StructFormats.Header.value, raw_header)[HeaderIndices.Sign]
+            assert sign & (SignBits.OPA | SignBits.OPB) == SignBits.OPA
+
+    with open(temp_file, 'rb') as f:
+        raw_header = f.read(StructSizes.Header)
+        sign = struct.unpack(StructFormats.Header.value, raw_header)[HeaderIndices.Sign]
+        assert sign & (SignBits.OPA | SignBits.OPB) == 0
+
+    # Closing again is a no-op
+    oa.close()
+
+
+def test_close_wakes_sender(temp_file):
+    test_buff_size = 16
+    sender = MmapIPC(temp_file, buff_size=test_buff_size)
+    receiver = MmapIPC(temp_file, buff_size=test_buff_size)
+
+    # Sender blocked on a full ring sees the reset offsets right after the peer closes
+    sender.send(b'A' * 12)
+    result = []
+    t = threading.Thread(target=lambda: result.append(sender.send(b'B' * 12, blocking=True, timeout=5.0)))
+    t.start()
+    time.sleep(0.05)
+    start = time.monotonic()
+    receiver.close()
+    t.join()
+    assert time.monotonic() - start < WAKE_LATENCY
+    assert result == [12]
+
+    sender.close()
+
+
 def test_send_recv_basic(temp_file):
+    with MmapIPC(temp_file) as sender, MmapIPC(temp_file) as receiver:
+        test_data = b'Hello Worlda'
+        sent_num = sender.send(test_data)
+        assert sent_num == len(test_data)
+
+        recv_data = receiver.recv()
+        assert recv_data == test_data
+
+
+def test_recv_into(temp_file):
     sender = MmapIPC(temp_file)
     receiver = MmapIPC(temp_file)
 
+    buffer = bytearray(16)
+    assert receiver.recv_into(buffer) is None
+
     test_data = b'Hello Worlda'
-    sent_num = sender.send(test_data)
-    assert sent_num == len(test_data)
+    sender.send(test_data)
+    sender.send(b'B' * 32)
 
-    recv_data = receiver.recv()
-    assert recv_data == test_data
+    assert receiver.recv_into(buffer) == len(test_data)
+    assert buffer[:len(test_data)] == test_data
+
+    # Too small, message stays in the buffer
+    with pytest.raises(ValueError):
+        receiver.recv_into(buffer)
+
+    assert receiver.recv() == b'B' * 32
 
 
 def test_multi_data_transfer(temp_file):
-    sender = MmapIPC(temp_file)
-    receiver = MmapIPC(temp_file)
+    with MmapIPC(temp_file) as sender, MmapIPC(temp_file) as receiver:
+        test_data_1 = b'A' * 1024
+        test_data_2 = b'B' * 1024
+
+        sent_num_1 = sender.send(test_data_1)
+        assert sent_num_1 == len(test_data_1)
+        sent_num_2 = sender.send(test_data_2)
+        assert sent_num_2 == len(test_data_2)
+
+        recv_data_1 = receiver.recv()
+        assert recv_data_1 == test_data_1
+        recv_data_2 = receiver.recv()
+        assert recv_data_2 == test_data_2
+
 
-    test_data_1 = b'A' * 1024
-    test_data_2 = b'B' * 1024
+def test_send_recv_many(temp_file):
+    test_buff_size = 32
+    sender = MmapIPC(temp_file, buff_size=test_buff_size)
+    receiver = MmapIPC(temp_file, buff_size=test_buff_size)
+
+    assert receiver.recv_many() == []
+
+    # Can never fit, even though every message would on its own
+    with pytest.raises(ValueError):
+        sender.send_many([b'A' * 8, b'B' * 8, b'C' * 8])
+
+    with pytest.raises(ValueError):
+        sender.send_many([b'A' * 8, b'B' * 8, b'C' * 8], blocking=True, timeout=None)
 
-    sent_num_1 = sender.send(test_data_1)
-    assert sent_num_1 == len(test_data_1)
-    sent_num_2 = sender.send(test_data_2)
-    assert sent_num_2 == len(test_data_2)
+    # Does not fit as a whole right now, nothing is sent
+    assert sender.send(b'X' * 8) == 8
+    assert sender.send_many([b'A' * 8, b'B' * 8]) == 0
+    assert receiver.recv() == b'X' * 8
 
-    recv_data_1 = receiver.recv()
-    assert recv_data_1 == test_data_1
-    recv_data_2 = receiver.recv()
-    assert recv_data_2 == test_data_2
+    test_data = [b'A' * 4, b'B' * 8, b'C' * 4]
+    assert sender.send_many(test_data) == len(test_data)
+
+    assert receiver.recv_many(max_count=2) == test_data[:2]
+
+    # Wraps around the end of the buffer
+    assert sender.send_many([b'D' * 8, b'E' * 4]) == 2
+    assert receiver.recv_many() == [b'C' * 4, b'D' * 8, b'E' * 4]
 
 
 def test_buffer_full(temp_file):
@@ -138,6 +254,37 @@ def test_buffer_full(temp_file):
     assert sender.send(b'C') == 0
 
 
+def test_buffer_size_rounding(temp_file):
+    # 10 is rounded up to 16
+    sender = MmapIPC(temp_file, buff_size=10)
+    receiver = MmapIPC(temp_file, buff_size=10)
+
+    test_data = b'A' * (16 - 4)
+    assert sender.send(test_data) == len(test_data)
+    assert sender.send(b'B') == 0
+    assert receiver.recv() == test_data
+
+    with pytest.raises(ValueError):
+        MmapIPC(temp_file, buff_size=0)
+
+
+def test_payload_pages(temp_file):
+    page_size = 4096
+
+    # Default ring: payload 256..4352 holds no whole page, so it gets no hint
+    buff_base_ptr_A, buff_base_ptr_B, _ = _calc_layout(4096)
+    assert _payload_pages(buff_base_ptr_A + StructSizes.Buffer, 4096, page_size) == (4096, 0)
+    assert _payload_pages(buff_base_ptr_B + StructSizes.Buffer, 4096, page_size)[1] == 0
+
+    # Larger rings: only whole pages inside the payload
+    buff_base_ptr_A, buff_base_ptr_B, _ = _calc_layout(65536)
+    assert _payload_pages(buff_base_ptr_A + StructSizes.Buffer, 65536, page_size) == (4096, 61440)
+    assert _payload_pages(buff_base_ptr_B + StructSizes.Buffer, 65536, page_size) == (69632, 61440)
+
+    # The hint itself is accepted for such a ring
+    MmapIPC(temp_file, buff_size=65536).close()
+
+
 def test_ring_buffer_wrapping(temp_file):
     test_buff_size = 32
     sender = MmapIPC(temp_file, buff_size=test_buff_size)
@@ -197,24 +344,94 @@ def test_overtime_rw(temp_file):
         receiver.recv(blocking=True, timeout=0.1)
 
 
+def test_blocking_wakeup(temp_file):
+    test_buff_size = 16
+    sender = MmapIPC(temp_file, buff_size=test_buff_size)
+    receiver = MmapIPC(temp_file, buff_size=test_buff_size)
+
+    # Blocked recv is woken by send
+    result = []
+    t = threading.Thread(target=lambda: result.append(receiver.recv(blocking=True, timeout=5.0)))
+    t.start()
+    time.sleep(0.05)
+    start = time.monotonic()
+    sender.send(b'A' * 12)
+    t.join()
+    assert time.monotonic() - start < WAKE_LATENCY
+    assert result == [b'A' * 12]
+
+    # Blocked send is woken by recv
+    sender.send(b'B' * 12)
+    t = threading.Thread(target=lambda: result.append(sender.send(b'C' * 12, blocking=True, timeout=5.0)))
+    t.start()
+    time.sleep(0.05)
+    start = time.monotonic()
+    assert receiver.recv() == b'B' * 12
+    t.join()
+    assert time.monotonic() - start < WAKE_LATENCY
+    assert result[1] == 12
+    assert receiver.recv() == b'C' * 12
+
+
+def test_polling_fallback(temp_file, monkeypatch):
+    monkeypatch.setattr(_futex, 'SUPPORTED', False)
+    test_buff_size = 16
+    sender = MmapIPC(temp_file, buff_size=test_buff_size)
+    receiver = MmapIPC(temp_file, buff_size=test_buff_size)
+    assert sender._mmap_addr == receiver._mmap_addr == 0
+
+    # Timeouts are honoured while polling
+    start = time.monotonic()
+    with pytest.raises(TimeoutError):
+        receiver.recv(blocking=True, timeout=0.2)
+    assert 0.2 <= time.monotonic() - start < 1.0
+
+    # Blocked recv picks up a later send
+    result = []
+    t = threading.Thread(target=lambda: result.append(receiver.recv(blocking=True, timeout=5.0)))
+    t.start()
+    time.sleep(0.05)
+    sender.send(b'A' * 12)
+    t.join()
+    assert result == [b'A' * 12]
+
+    # Blocked send picks up space freed by a later recv
+    sender.send(b'B' * 12)
+    start = time.monotonic()
+    with pytest.raises(TimeoutError):
+        sender.send(b'C' * 12, blocking=True, timeout=0.2)
+    assert 0.2 <= time.monotonic() - start < 1.0
+
+    t = threading.Thread(target=lambda: result.append(sender.send(b'C' * 12, blocking=True, timeout=5.0)))
+    t.start()
+    time.sleep(0.05)
+    assert receiver.recv() == b'B' * 12
+    t.join()
+    assert result[1] == 12
+    assert receiver.recv() == b'C' * 12
+
+    sender.close()
+    receiver.close()
+
+
 def _task_send(temp_file: str, test_data: List[bytes], queue: Queue) -> None:
-    sender = MmapIPC(temp_file)
     status = []
-    for i in range(10):
-        index = i % len(test_data)
-        sent_num = sender.send(test_data[index], blocking=True, timeout=None)
-        status.append(sent_num == len(test_data[index]))
+    with MmapIPC(temp_file) as sender:
+        for i in range(10):
+            index = i % len(test_data)
+            sent_num = sender.send(test_data[index], blocking=True, timeout=None)
+            status.append(sent_num == len(test_data[index]))
 
     queue.put(("send", status))
 
 
 def _task_read(temp_file: str, test_data: List[bytes], queue: Queue) -> None:
-    reader = MmapIPC(temp_file)
     status = []
-    for i in range(10):
-        index = i % len(test_data)
-        recv_data = reader.recv(blocking=True)
-        status.append(recv_data == test_data[index])
+    with MmapIPC(temp_file) as reader:
+        for i in range(10):
+            index = i % len(test_data)
+            recv_data = reader.recv(blocking=True)
+            status.append(recv_data == test_data[index])
 
     queue.put(("recv", status))
 
@@ -243,10 +460,47 @@ def test_multiprocess_rw_concurrent(temp_file):
     p_read.join()
     p_send.join()
 
-    status_1 = queue.get()
-    status_2 = queue.get()
+    status_1 = queue.get(timeout=30)
+    status_2 = queue.get(timeout=30)
 
     print(status_1)
     print(status_2)
 
     assert status_1[1] == status_2[1]
+
+
+def _task_open(temp_file: str, start: synchronize.Barrier, done: synchronize.Barrier, queue: Queue) -> None:
+    start.wait()
+    try:
+        ipc = MmapIPC(temp_file)
+
+    except Exception as e:
+        queue.put(repr(e))
+        done.wait()
+        return
+
+    queue.put(int(ipc.assign_op))
+
+    # Hold the slot until both sides have reported
+    done.wait()
+    ipc.close()
+
+
+def test_multiprocess_open_race(tmp_path):
+    for i in range(100):
+        temp_file = str(tmp_path / f"test_race_{i}.mmap")
+
+        start = Barrier(2)
+        done = Barrier(2)
+        queue = Queue()
+        processes = [Process(target=_task_open, args=(temp_file, start, done, queue)) for _ in range(2)]
+
+        for p in processes:
+            p.start()
+
+        results = [queue.get(timeout=30), queue.get(timeout=30)]
+
+        for p in processes:
+            p.join()
+
+        assert set(results) == {SignBits.OPA, SignBits.OPB}